@@ -1,11 +1,18 @@
+import os
 import sys
+import csv
+import tempfile
+import textwrap
 import argparse
 import logging
 import json
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
+from collections import OrderedDict, deque
 from itertools import groupby
 
 import h3
+from h3.api import numpy_int as h3_int
 import numpy as np
 import folium
 from branca.colormap import linear
@@ -151,32 +158,79 @@ for hexa in us_hexagons:
     us_hexagons_extended.update(h3.grid_ring(hexa, k=1))
 
 
+# Max number of candidate cells kept in the footprint stencil cache (~24 bytes each)
+STENCIL_CACHE_CELLS = 2_000_000
+
+# Same earth radius used by h3.great_circle_distance
+EARTH_RADIUS_KM = 6371.007180918475
+
+_stencil_cache = OrderedDict()
+_stencil_cache_cells = 0
+
+
+def footprint_stencil(origin, k):
+    """
+    Finds the candidate cells for the affected areas of an epicenter inside the `origin` cell (an integer H3 index)
+
+    Returns a tuple (cells, lats, lngs) with the cells up to k rings away from origin, in the same order as walking
+    the rings, as an uint64 array and the latitude and longitude of their centers in radians.
+
+    Built with the integer H3 API to avoid the string conversions, that are most of the cost of walking the rings.
+    The stencils are kept in a LRU cache (bounded by STENCIL_CACHE_CELLS) because slow-moving storms, and storms in
+    the same region, repeat the same origin cells.
+    """
+    global _stencil_cache_cells
+    key = (origin, k)
+    if key in _stencil_cache:
+        _stencil_cache.move_to_end(key)
+        return _stencil_cache[key]
+
+    cells = np.concatenate(
+        [np.array([origin], dtype=np.uint64)] + [h3_int.grid_ring(origin, r) for r in range(1, k + 1)]
+    )
+    _, first_positions = np.unique(cells, return_index=True)
+    if len(first_positions) < len(cells):
+        # The rings can repeat cells around pentagons, keep the first one
+        cells = cells[np.sort(first_positions)]
+    centers = np.radians([h3_int.cell_to_latlng(hexagon) for hexagon in cells.tolist()])
+    stencil = cells, centers[:, 0], centers[:, 1]
+
+    _stencil_cache[key] = stencil
+    _stencil_cache_cells += len(cells)
+    while _stencil_cache_cells > STENCIL_CACHE_CELLS and len(_stencil_cache) > 1:
+        _, (evicted_cells, _, _) = _stencil_cache.popitem(last=False)
+        _stencil_cache_cells -= len(evicted_cells)
+    return stencil
+
+
+def great_circle_distances(lat, lng, lats, lngs):
+    """
+    Vectorized version of h3.great_circle_distance (in km) from (lat, lng) in degrees to arrays in radians
+
+    lat and lng can also be arrays, broadcasted against lats and lngs
+    """
+    lat, lng = np.radians(lat), np.radians(lng)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)) * EARTH_RADIUS_KM
+
+
 def epicenter_areas_affected(lat, lng, radius_km, resolution, severity_function):
     """
     Finds the affected areas of a given resultion within a given radium
 
     Returns a dictionary of <h3index>=>distance * severity_factor
     """
-    origin = h3.latlng_to_cell(lat, lng, resolution)
+    origin = h3_int.latlng_to_cell(lat, lng, resolution)
     edge_length_km = EDGE_LENGTH[resolution]
     k = int(np.ceil(radius_km / edge_length_km))
 
-    result = {}
-    for r in range(0, k + 1):
-        if r == 0:
-            ring = {origin}
-        else:
-            ring = h3.grid_ring(origin, r)
-
-        for hexagon in ring:
-            if hexagon in result:
-                continue
-            hex_center = h3.cell_to_latlng(hexagon)
-            distance = h3.great_circle_distance((lat, lng), hex_center, unit="km")
-            if distance <= (radius_km + edge_length_km):
-                result[hexagon] = severity_function(distance=distance)
-
-    return result
+    cells, lats, lngs = footprint_stencil(origin, k)
+    distances = great_circle_distances(lat, lng, lats, lngs)
+    in_range = np.flatnonzero(distances <= (radius_km + edge_length_km))
+    return dict(
+        (h3.int_to_str(hexagon), severity_function(distance=distance))
+        for hexagon, distance in zip(cells[in_range].tolist(), distances[in_range].tolist())
+    )
 
 
 def severity_function_range5(radius_km, resolution, min_wind, distance, wind):
@@ -280,6 +334,260 @@ def compact_impacted_indexes(h3_indexes):
     return h3_indexes_compacted
 
 
+def bounded_map(executor, fn, *iterables, max_pending=None):
+    """
+    Like executor.map, but submitting the tasks as the results are consumed
+
+    executor.map submits everything up front, so the results not consumed yet pile up in memory. Here at most
+    `max_pending` tasks (defaults to twice the CPUs) are in flight. The results are returned in order.
+    """
+    max_pending = max_pending or 2 * (os.cpu_count() or 1)
+    pending = deque()
+    try:
+        for fn_args in zip(*iterables):
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, *fn_args))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def spill_price_list_partitions(hurdat2_filename, years, find_indexes_fn, spill_dir, executor, max_pending=None):
+    """
+    First pass of the partitioned price list: computes the affected areas of each storm and appends them to a CSV
+    file per level 2 parent cell, so the severities are never kept in memory for the whole country.
+
+    Returns a dictionary of <h3 level2 index> => filename
+    """
+    partition_files = {}
+
+    def spill(h3_indexes):
+        for h3_index, severity in h3_indexes.items():
+            h3_level2 = h3.cell_to_parent(h3_index, 2)
+            if h3_level2 not in partition_files:
+                partition_files[h3_level2] = open(os.path.join(spill_dir, f"{h3_level2}.csv"), "w")
+            partition_files[h3_level2].write(f"{h3_index},{severity}\n")
+
+    try:
+        for h3_indexes in bounded_map(
+            executor, find_indexes_fn, hurdat2json.read_storms(hurdat2_filename, years), max_pending=max_pending
+        ):
+            spill(h3_indexes)
+    finally:
+        for partition_file in partition_files.values():
+            partition_file.close()
+    return dict((h3_level2, partition_file.name) for h3_level2, partition_file in partition_files.items())
+
+
+def compute_price_list_partition(h3_level2, partition_filename, years_count, resolution, min_loss_prob):
+    """
+    Computes the compacted price list of the areas inside a level 2 cell, reading the severities spilled by
+    spill_price_list_partitions. Same computation than compute_price_list + price_list_command, but for a single
+    partition.
+    """
+    commulative_severity = {}
+    if partition_filename is not None:
+        with open(partition_filename) as partition_file:
+            for line in partition_file:
+                h3_index, severity = line.rstrip("\n").split(",")
+                commulative_severity[h3_index] = commulative_severity.get(h3_index, 0) + int(severity)
+    # Round to 3 decimals (E.g. 5.1%)
+    h3_indexes = dict(
+        (h3_index, round((severity / MAX_SEVERITY) / years_count, 3))
+        for h3_index, severity in commulative_severity.items()
+    )
+    if h3_level2 in us_hexagons_extended:
+        # Complete all the h3 regions in US making sure they have at least the min_loss_prob
+        all_us_indexes = dict((h3_index, min_loss_prob) for h3_index in h3.cell_to_children(h3_level2, resolution))
+        _merge_into(all_us_indexes, h3_indexes, lambda a, b: a if a >= b else b)
+        h3_indexes = all_us_indexes
+    return compact_impacted_indexes(h3_indexes)
+
+
+H3_RES_OFFSET = 52
+H3_RES_MASK = np.uint64(0xF << H3_RES_OFFSET)
+H3_MAX_RES = 15
+
+
+def h3_resolutions(h3_ints):
+    """Returns the resolution of each index of an uint64 array of H3 indexes"""
+    return ((h3_ints & H3_RES_MASK) >> np.uint64(H3_RES_OFFSET)).astype(np.int64)
+
+
+def h3_parents(h3_ints, resolution):
+    """
+    Vectorized version of h3.cell_to_parent for an uint64 array of H3 indexes
+
+    Sets the resolution field and fills the digits finer than `resolution` with 7 (unused digit), as described in
+    https://h3geo.org/docs/library/index/cell
+    """
+    unused_digits = np.uint64((1 << (3 * (H3_MAX_RES - resolution))) - 1)
+    return (h3_ints & ~H3_RES_MASK) | np.uint64(resolution << H3_RES_OFFSET) | unused_digits
+
+
+def read_portfolio(filename, index_column="h3_index", exposure_column="exposure"):
+    """
+    Reads a portfolio of policies from a CSV or Parquet file
+
+    Returns a tuple of two numpy arrays (h3_indexes as uint64, exposures as float64)
+    """
+    if filename.endswith(".parquet"):
+        # Optional dependency, only required for Parquet portfolios
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(filename, columns=[index_column, exposure_column])
+        exposures = table.column(exposure_column).to_numpy().astype(np.float64)
+        indexes = table.column(index_column)
+        if pa.types.is_integer(indexes.type):
+            return indexes.to_numpy().astype(np.uint64), exposures
+        indexes = indexes.to_pylist()
+    else:
+        with open(filename) as portfolio_file:
+            reader = csv.DictReader(portfolio_file)
+            indexes, exposures = [], []
+            for row in reader:
+                indexes.append(row[index_column])
+                exposures.append(float(row[exposure_column]))
+        exposures = np.array(exposures, dtype=np.float64)
+
+    h3_ints = np.fromiter((h3.str_to_int(h3_index) for h3_index in indexes), dtype=np.uint64, count=len(indexes))
+    return h3_ints, exposures
+
+
+def aggregate_portfolio(h3_ints, exposures, resolution):
+    """
+    Aggregates a portfolio of policies by footprint cell, ready to be replayed against many storms
+
+    The policies are grouped by their parent at `resolution` (the resolution of the storm footprints) into a sorted
+    uint64 array, so each storm is matched against the portfolio with a single `np.searchsorted`.
+    """
+    if len(h3_ints) and h3_resolutions(h3_ints).min() < resolution:
+        raise ValueError(f"All the policies must have a resolution of at least {resolution}")
+    cells, inverse = np.unique(h3_parents(h3_ints, resolution), return_inverse=True)
+    level2_cells, level2_inverse = np.unique(h3_parents(cells, 2), return_inverse=True)
+    return dict(
+        cells=cells,
+        exposures=np.bincount(inverse, weights=exposures, minlength=len(cells)),
+        level2_cells=level2_cells,
+        level2_inverse=level2_inverse,
+    )
+
+
+def storm_payouts(portfolio, h3_indexes):
+    """
+    Computes the payouts of a storm footprint (dict of h3_index => severity) over an aggregated portfolio
+
+    Returns a numpy array with the payout for each level-2 cell (aligned with portfolio["level2_cells"])
+    """
+    cells = portfolio["cells"]
+    if not h3_indexes or not len(cells):
+        return np.zeros(len(portfolio["level2_cells"]))
+    footprint = np.fromiter((h3.str_to_int(h3_index) for h3_index in h3_indexes.keys()), dtype=np.uint64)
+    severities = np.fromiter(h3_indexes.values(), dtype=np.float64)
+    positions = np.searchsorted(cells, footprint)
+    positions[positions == len(cells)] = 0
+    matched = cells[positions] == footprint
+    positions = positions[matched]
+    return np.bincount(
+        portfolio["level2_inverse"][positions],
+        weights=severities[matched] / MAX_SEVERITY * portfolio["exposures"][positions],
+        minlength=len(portfolio["level2_cells"]),
+    )
+
+
+def exceedance_curve(annual_losses):
+    """
+    Computes the empirical exceedance-probability curve of a list of annual losses
+
+    Returns a list of (loss, exceedance_prob, return_period) sorted by decreasing loss
+    """
+    losses = np.sort(np.asarray(annual_losses, dtype=np.float64))
+    # Probability of a year with a loss greater or equal than each loss (ties share the same probability)
+    exceedance_probs = (len(losses) - np.searchsorted(losses, losses, side="left")) / len(losses)
+    return [(loss, prob, 1 / prob) for loss, prob in zip(losses[::-1].tolist(), exceedance_probs[::-1].tolist())]
+
+
+def read_forecast_members(filenames):
+    """
+    Reads the tracks of the members of a forecast ensemble
+
+    Each file is a JSON with a storm in the format of hurdat2json.parse_storm or just the list of its records.
+    """
+    members = []
+    for filename in filenames:
+        with open(filename) as member_file:
+            member = json.load(member_file)
+        members.append(member["records"] if isinstance(member, dict) else member)
+    return members
+
+
+def severity_range5_array(radius_km, resolution, min_wind, distances, winds):
+    """Vectorized version of severity_function_range5 for arrays of distances and winds"""
+    edge_length_km = EDGE_LENGTH[resolution]
+    distance_factors = MAX_SEVERITY - np.round(distances / ((radius_km + edge_length_km) / (MAX_SEVERITY - 1)))
+    wind_factors = np.array([0, 1, 1.5, 2])[np.minimum(np.round(winds / min_wind), 3).astype(np.int64)]
+    return np.minimum(np.round(distance_factors * wind_factors), MAX_SEVERITY).astype(np.int8)
+
+
+def find_ensemble_impacted_indexes(members, radius_km, resolution, min_wind):
+    """
+    Computes the affected areas of all the members of a forecast ensemble in a single pass
+
+    The track points of all the members are grouped by footprint stencil, so the candidate cells (and their centers)
+    are shared by all the members and the distances and severities are computed for the whole group at once.
+
+    Returns a tuple (h3_indexes, severities) where severities is an array of members x h3_indexes with the severity
+    of each area for each member (0 if not affected)
+    """
+    edge_length_km = EDGE_LENGTH[resolution]
+    k = int(np.ceil(radius_km / edge_length_km))
+    groups = {}
+    for member_index, records in enumerate(members):
+        for record in records:
+            wind = record["max_sustained_wind"]
+            if wind < min_wind:
+                continue
+            lat, lng = record["lat"], record["lng"]
+            if not is_in_us(lat, lng):
+                continue  # Skip because not in US
+            origin = h3_int.latlng_to_cell(lat, lng, resolution)
+            groups.setdefault(origin, []).append((member_index, lat, lng, wind))
+
+    h3_positions = {}
+    hit_members, hit_positions, hit_severities = [], [], []
+    for origin, fixes in groups.items():
+        member_indexes, lats, lngs, winds = (np.array(values) for values in zip(*fixes))
+        cells, cell_lats, cell_lngs = footprint_stencil(origin, k)
+        # Matrix of fixes x candidate cells
+        distances = great_circle_distances(lats[:, None], lngs[:, None], cell_lats, cell_lngs)
+        in_range = distances <= (radius_km + edge_length_km)
+        fix_hits, cell_hits = np.nonzero(in_range)
+        hit_cells, hit_cells_inverse = np.unique(cell_hits, return_inverse=True)
+        positions = np.array(
+            [h3_positions.setdefault(hexagon, len(h3_positions)) for hexagon in cells[hit_cells].tolist()],
+            dtype=np.int64,
+        )
+        hit_members.append(member_indexes[fix_hits])
+        hit_positions.append(positions[hit_cells_inverse])
+        hit_severities.append(
+            severity_range5_array(radius_km, resolution, min_wind, distances[fix_hits, cell_hits], winds[fix_hits])
+        )
+
+    severities = np.zeros((len(members), len(h3_positions)), dtype=np.int8)
+    if h3_positions:
+        # Each member keeps the greatest severity of its track points
+        np.maximum.at(
+            severities,
+            (np.concatenate(hit_members).astype(np.int64), np.concatenate(hit_positions).astype(np.int64)),
+            np.concatenate(hit_severities).astype(np.int8),
+        )
+    return [h3.int_to_str(hexagon) for hexagon in h3_positions], severities
+
+
 severity_palette = {
     1: "#A8E6CF",  # Light Green (Lowest severity)
     2: "#6EC6FF",  # Soft Blue (Low-Moderate severity)
@@ -426,7 +734,13 @@ def parse_args(args):
         default=64,
     )
 
-    parser.add_argument("--resolution", type=int, help="Max H3 resolution to report", default=6)
+    parser.add_argument(
+        "--resolution",
+        type=int,
+        choices=sorted(EDGE_LENGTH.keys()),
+        help="Max H3 resolution to report",
+        default=6,
+    )
 
     subparsers = parser.add_subparsers(dest="command", required=True, help="sub-command to run")
 
@@ -464,7 +778,81 @@ def parse_args(args):
     price_list.add_argument("--map-output", type=str, help="Output for the HTML map")
     price_list.add_argument("--json-output", type=str, help="Output in JSON")
 
-    return parser.parse_args(args)
+    price_list.add_argument(
+        "--partitioned",
+        action="store_true",
+        help="Process the price list by level 2 cell, with bounded memory (recommended for resolution 7 or finer). "
+        "Can't be used with --map-output",
+    )
+    price_list.add_argument(
+        "--workers",
+        type=int,
+        help="Number of processes used in partitioned mode (defaults to the number of CPUs)",
+        default=None,
+    )
+    price_list.add_argument(
+        "--spill-dir",
+        type=str,
+        help="Directory for the temporary partition files in partitioned mode",
+        default=None,
+    )
+
+    portfolio_replay = subparsers.add_parser("portfolio_replay")
+
+    portfolio_replay.add_argument(
+        "--portfolio",
+        type=str,
+        required=True,
+        help="Portfolio of policies, in CSV or Parquet (.parquet) format",
+    )
+    portfolio_replay.add_argument(
+        "--index-column",
+        type=str,
+        help="Column of the portfolio with the H3 index of each policy",
+        default="h3_index",
+    )
+    portfolio_replay.add_argument(
+        "--exposure-column",
+        type=str,
+        help="Column of the portfolio with the insured amount of each policy",
+        default="exposure",
+    )
+    portfolio_replay.add_argument(
+        "--year-from",
+        type=int,
+        help="First year to consider",
+        default=1950,
+    )
+    portfolio_replay.add_argument(
+        "--year-to",
+        type=int,
+        help="Last year to consider",
+        default=2024,
+    )
+    portfolio_replay.add_argument("--loss-table-output", type=str, help="Output of the loss table in CSV")
+    portfolio_replay.add_argument("--json-output", type=str, help="Output in JSON")
+
+    forecast = subparsers.add_parser("forecast")
+
+    forecast.add_argument(
+        "--members",
+        type=str,
+        nargs="+",
+        required=True,
+        help="JSON files with the forecast track of each member of the ensemble",
+    )
+
+    forecast.add_argument("--map-output", type=str, help="Output for the HTML map")
+
+    forecast.add_argument("--json-output", type=str, help="Output in JSON")
+
+    args = parser.parse_args(args)
+    if getattr(args, "partitioned", False):
+        if args.resolution < 2:
+            parser.error("--partitioned requires a --resolution of at least 2")
+        if args.map_output:
+            parser.error("--map-output needs all the areas in memory, it can't be used with --partitioned")
+    return args
 
 
 def setup_logging(loglevel):
@@ -514,7 +902,34 @@ def affected_areas_command(args):
         )
 
 
+def save_price_list_map(map_output, h3_indexes_compacted):
+    center_lat, center_lng = compute_centroid(h3_indexes_compacted.keys())
+    map = folium.Map(location=[center_lat, center_lng], zoom_start=8)
+
+    colormap = linear.YlOrRd_09.scale(
+        min(h3_indexes_compacted.values()),
+        max(h3_indexes_compacted.values()),
+    )
+    colormap.caption = "Loss Prob"
+    display_h3_indexes(
+        map,
+        h3_indexes_compacted,
+        properties_fn=lambda h3_data: {"loss_prob": h3_data},
+        style_fn=lambda feature: {
+            "fillColor": colormap(feature["properties"]["loss_prob"]),
+            "color": colormap(feature["properties"]["loss_prob"]),
+            "weight": 1,
+            "fillOpacity": 0.4,
+        },
+        tooltip_fn=lambda h3_index, h3_data: f"H3 Res: {h3.get_resolution(h3_index)} / LossProb: {h3_data * 100:.1f}%",
+        popup_fn=lambda h3_index, h3_data: f"<b>H3 Index:</b> {h3_index}<br><b>Resolution:</b> {h3.get_resolution(h3_index)}  <b>LossProb:</b> {h3_data * 100:.1f}% ",
+    )
+    map.save(map_output)
+
+
 def price_list_command(args):
+    if args.partitioned:
+        return price_list_partitioned_command(args)
     h3_indexes = compute_price_list(
         args.hurdat2,
         years=list(range(args.year_from, args.year_to + 1)),
@@ -542,35 +957,196 @@ def price_list_command(args):
     logger.info(f"Original H3 indexes {len(h3_indexes)} vs Compacted {len(h3_indexes_compacted)}")
 
     if args.map_output:
-        center_lat, center_lng = compute_centroid(h3_indexes_compacted.keys())
-        map = folium.Map(location=[center_lat, center_lng], zoom_start=8)
+        save_price_list_map(args.map_output, h3_indexes_compacted)
+    if args.json_output:
+        json.dump(
+            {
+                "type": "price_list",
+                "year_from": args.year_from,
+                "year_to": args.year_to,
+                "areas": [(h3_index, loss_prob) for h3_index, loss_prob in h3_indexes_compacted.items()],
+            },
+            open(args.json_output, "w"),
+            indent=2,
+        )
+
 
-        colormap = linear.YlOrRd_09.scale(
-            min(h3_indexes_compacted.values()),
-            max(h3_indexes_compacted.values()),
+def price_list_partitioned_command(args):
+    """
+    Same output than price_list_command, but sharding the work by level 2 cell, so the peak memory is bounded by the
+    largest partition instead of the whole US at the given resolution.
+    """
+    years = list(range(args.year_from, args.year_to + 1))
+    # Partitions compacted to a single level 2 cell might be compacted further with their siblings
+    level2_areas = {}
+    compacted_count = 0
+    max_pending = 2 * (args.workers or os.cpu_count() or 1)
+
+    with tempfile.TemporaryDirectory(dir=args.spill_dir) as spill_dir, ProcessPoolExecutor(args.workers) as executor:
+        partition_files = spill_price_list_partitions(
+            args.hurdat2,
+            years,
+            find_indexes_fn=partial(
+                find_impacted_indexes,
+                radius_km=args.radius,
+                min_wind=args.min_wind,
+                resolution=args.resolution,
+            ),
+            spill_dir=spill_dir,
+            executor=executor,
+            max_pending=max_pending,
+        )
+        partitions = sorted(us_hexagons_extended | partition_files.keys())
+        logger.info(f"{len(partition_files)} partitions with affected areas, {len(partitions)} in total")
+
+        json_output = open(args.json_output, "w") if args.json_output else None
+
+        def write_areas(areas):
+            nonlocal compacted_count
+            for h3_index, loss_prob in areas.items():
+                if json_output is not None:
+                    json_output.write(",\n" if compacted_count else "\n")
+                    json_output.write(textwrap.indent(json.dumps([h3_index, loss_prob], indent=2), "    "))
+                compacted_count += 1
+
+        if json_output is not None:
+            json_output.write(
+                "{\n"
+                + f'  "type": "price_list",\n  "year_from": {args.year_from},\n  "year_to": {args.year_to},\n'
+                + '  "areas": ['
+            )
+        for h3_level2, areas in zip(
+            partitions,
+            bounded_map(
+                executor,
+                partial(
+                    compute_price_list_partition,
+                    years_count=len(years),
+                    resolution=args.resolution,
+                    min_loss_prob=args.min_loss_prob,
+                ),
+                partitions,
+                [partition_files.get(h3_level2) for h3_level2 in partitions],
+                max_pending=max_pending,
+            ),
+        ):
+            if list(areas.keys()) == [h3_level2]:
+                level2_areas[h3_level2] = areas[h3_level2]
+            else:
+                write_areas(areas)
+        write_areas(compact_impacted_indexes(level2_areas))
+        if json_output is not None:
+            json_output.write("\n  ]\n}" if compacted_count else "]\n}")
+            json_output.close()
+
+    logger.info(f"Compacted H3 indexes {compacted_count} in {len(partitions)} partitions")
+
+
+def portfolio_replay_command(args):
+    h3_ints, exposures = read_portfolio(args.portfolio, args.index_column, args.exposure_column)
+    portfolio = aggregate_portfolio(h3_ints, exposures, args.resolution)
+    logger.info(f"{len(h3_ints)} policies aggregated in {len(portfolio['cells'])} cells")
+    level2_cells = [h3.int_to_str(int(h3_int)) for h3_int in portfolio["level2_cells"]]
+
+    years = list(range(args.year_from, args.year_to + 1))
+    annual_losses = dict((year, 0.0) for year in years)
+    storms = []
+    loss_table = []
+    for storm in hurdat2json.read_storms(args.hurdat2, years):
+        h3_indexes = find_impacted_indexes(
+            storm,
+            radius_km=args.radius,
+            min_wind=args.min_wind,
+            resolution=args.resolution,
         )
-        colormap.caption = "Loss Prob"
+        payouts = storm_payouts(portfolio, h3_indexes)
+        loss = float(payouts.sum())
+        if not loss:
+            continue
+        logger.info(f"Storm {storm['id']} ({storm['name']}) loss: {loss:.2f}")
+        annual_losses[storm["year"]] += loss
+        storms.append({"id": storm["id"], "name": storm["name"], "year": storm["year"], "loss": loss})
+        loss_table.extend(
+            (storm["id"], storm["name"], storm["year"], level2_cells[i], float(payouts[i]))
+            for i in np.flatnonzero(payouts)
+        )
+
+    ep_curve = exceedance_curve(list(annual_losses.values()))
+
+    if args.loss_table_output:
+        with open(args.loss_table_output, "w", newline="") as loss_table_file:
+            writer = csv.writer(loss_table_file)
+            writer.writerow(["storm", "name", "year", "h3_level2", "loss"])
+            writer.writerows(loss_table)
+
+    if args.json_output:
+        json.dump(
+            {
+                "type": "portfolio_replay",
+                "year_from": args.year_from,
+                "year_to": args.year_to,
+                "policy_count": len(h3_ints),
+                "total_exposure": float(exposures.sum()),
+                "storms": storms,
+                "annual_losses": [(year, loss) for year, loss in annual_losses.items()],
+                "ep_curve": [
+                    {"loss": loss, "exceedance_prob": prob, "return_period": return_period}
+                    for loss, prob, return_period in ep_curve
+                ],
+            },
+            open(args.json_output, "w"),
+            indent=2,
+        )
+
+
+def forecast_command(args):
+    members = read_forecast_members(args.members)
+    h3_indexes, severities = find_ensemble_impacted_indexes(
+        members,
+        radius_km=args.radius,
+        min_wind=args.min_wind,
+        resolution=args.resolution,
+    )
+    if not h3_indexes:
+        print(f"No h3 indexes in US found for the {len(members)} members")
+        return
+    logger.info(f"{len(h3_indexes)} H3 indexes affected by the {len(members)} members")
+
+    # Probability of each severity (1..MAX_SEVERITY) for each area
+    severity_probs = np.stack(
+        [(severities == severity).mean(axis=0) for severity in range(1, MAX_SEVERITY + 1)], axis=1
+    )
+    h3_probs = dict(zip(h3_indexes, severity_probs.round(3).tolist()))
+
+    if args.map_output:
+        center_lat, center_lng = compute_centroid(h3_indexes)
+        map = folium.Map(location=[center_lat, center_lng], zoom_start=8)
+        colormap = linear.YlOrRd_09.scale(0, 1)
+        colormap.caption = "Affected Prob"
         display_h3_indexes(
             map,
-            h3_indexes_compacted,
-            properties_fn=lambda h3_data: {"loss_prob": h3_data},
+            h3_probs,
+            properties_fn=lambda h3_data: {"affected_prob": sum(h3_data)},
             style_fn=lambda feature: {
-                "fillColor": colormap(feature["properties"]["loss_prob"]),
-                "color": colormap(feature["properties"]["loss_prob"]),
+                "fillColor": colormap(feature["properties"]["affected_prob"]),
+                "color": colormap(feature["properties"]["affected_prob"]),
                 "weight": 1,
                 "fillOpacity": 0.4,
             },
-            tooltip_fn=lambda h3_index, h3_data: f"H3 Res: {h3.get_resolution(h3_index)} / LossProb: {h3_data * 100:.1f}%",
-            popup_fn=lambda h3_index, h3_data: f"<b>H3 Index:</b> {h3_index}<br><b>Resolution:</b> {h3.get_resolution(h3_index)}  <b>LossProb:</b> {h3_data * 100:.1f}% ",
+            tooltip_fn=lambda h3_index, h3_data: f"H3 Res: {h3.get_resolution(h3_index)} / AffectedProb: {sum(h3_data) * 100:.1f}%",
+            popup_fn=lambda h3_index, h3_data: f"<b>H3 Index:</b> {h3_index}<br><b>Resolution:</b> {h3.get_resolution(h3_index)}  <b>Severity Probs:</b> {h3_data} ",
         )
+        for records in members:
+            display_storm_path(map, records)
         map.save(args.map_output)
+
     if args.json_output:
         json.dump(
             {
-                "type": "price_list",
-                "year_from": args.year_from,
-                "year_to": args.year_to,
-                "areas": [(h3_index, loss_prob) for h3_index, loss_prob in h3_indexes_compacted.items()],
+                "type": "forecast",
+                "members": len(members),
+                "severities": [round(severity / MAX_SEVERITY, 2) for severity in range(1, MAX_SEVERITY + 1)],
+                "areas": [(h3_index, probs) for h3_index, probs in h3_probs.items()],
             },
             open(args.json_output, "w"),
             indent=2,
@@ -584,6 +1160,10 @@ def main(args):
         affected_areas_command(args)
     elif args.command == "price_list":
         price_list_command(args)
+    elif args.command == "portfolio_replay":
+        portfolio_replay_command(args)
+    elif args.command == "forecast":
+        forecast_command(args)
 
 
 def run():
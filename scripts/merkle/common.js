@@ -0,0 +1,116 @@
+import * as fs from "fs";
+import { ethers } from "ethers";
+import { LeanIMT } from "@zk-kit/lean-imt";
+import { poseidon2 } from "poseidon-lite";
+
+// Placeholder for the areas removed from a published list. The H3 index 0 is not a valid cell and its leaf is
+// poseidon2([0, 0]), the same used by the frontend to pad the trees.
+export const REMOVED_AREA = ["0", 0];
+
+export function floatToWad(lossProb) {
+  return BigInt(Math.round(lossProb * 10000)) * BigInt(10n ** 14n);
+}
+
+export function areaLeaf(area) {
+  return poseidon2(["0x" + area[0], floatToWad(area[1])]);
+}
+
+export const hash = (a, b) => poseidon2([a, b]);
+
+export function makePriceListMessage({ merkleRoot, validFrom, validTo }) {
+  return ethers.solidityPacked(
+    ["uint256", "uint40", "uint40"],
+    [merkleRoot, validFrom, validTo],
+  );
+}
+
+export async function signMerkleRoot(signer, merkleRoot, validFrom, validTo) {
+  console.log("Signer Address:", signer.address);
+  console.log("Merkle Root:", merkleRoot);
+  const message = makePriceListMessage({ merkleRoot, validFrom, validTo });
+  console.log("Message:", message);
+  const signature = ethers.Signature.from(
+    await signer.signMessage(ethers.getBytes(message)),
+  );
+  console.log("Signature:", signature);
+
+  return {
+    signature,
+    merkleRoot: merkleRoot.toString(),
+    validFrom,
+    validTo,
+    signer: signer.address,
+  };
+}
+
+/**
+ * Saves the tree and the areas (in leaf order) so the next publication only has to update the changed leaves
+ */
+export function saveTreeState(stateFile, tree, areas) {
+  const state = {
+    merkleRoot: tree.root.toString(),
+    areas,
+    nodes: tree.export(),
+  };
+  fs.writeFileSync(stateFile, JSON.stringify(state), "utf8");
+}
+
+export function loadTreeState(stateFile) {
+  const state = JSON.parse(fs.readFileSync(stateFile));
+  const tree = LeanIMT.import(hash, state.nodes, (value) => BigInt(value));
+  if (tree.root.toString() !== state.merkleRoot)
+    throw new Error(`Corrupted tree state: ${stateFile}`);
+  return { tree, areas: state.areas };
+}
+
+/**
+ * Compares a new list of areas with the previous one (in leaf order) by H3 index.
+ *
+ * Returns the changes as [leafIndex, h3Index, value] where leafIndex is the position of the area in the tree.
+ * Updated areas keep their position, removed areas are replaced by REMOVED_AREA and the new areas take the
+ * positions of the removed ones before being appended at the end.
+ */
+export function diffAreas(previousAreas, newAreas) {
+  const newValues = new Map(newAreas);
+  const previousPositions = new Map();
+  const changes = [];
+  const freePositions = [];
+
+  previousAreas.forEach(([h3Index, value], position) => {
+    if (h3Index === REMOVED_AREA[0]) {
+      freePositions.push(position);
+      return;
+    }
+    previousPositions.set(h3Index, position);
+    if (!newValues.has(h3Index)) {
+      freePositions.push(position);
+    } else if (floatToWad(newValues.get(h3Index)) !== floatToWad(value)) {
+      changes.push([position, h3Index, newValues.get(h3Index)]);
+    }
+  });
+
+  let nextPosition = previousAreas.length;
+  for (const [h3Index, value] of newAreas) {
+    if (previousPositions.has(h3Index)) continue;
+    const position =
+      freePositions.length > 0 ? freePositions.shift() : nextPosition++;
+    changes.push([position, h3Index, value]);
+  }
+  // Removed areas whose positions weren't taken by new areas
+  for (const position of freePositions) {
+    if (previousAreas[position][0] !== REMOVED_AREA[0])
+      changes.push([position, ...REMOVED_AREA]);
+  }
+  return changes.sort((a, b) => a[0] - b[0]);
+}
+
+/**
+ * Applies the changes of a delta file to a cached copy of the areas (in leaf order)
+ */
+export function applyAreasDelta(areas, delta) {
+  const result = [...areas];
+  for (const [position, h3Index, value] of delta.changes) {
+    result[position] = [h3Index, value];
+  }
+  return result;
+}
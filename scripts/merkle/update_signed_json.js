@@ -0,0 +1,80 @@
+import * as fs from "fs";
+import { ethers } from "ethers";
+import {
+  applyAreasDelta,
+  areaLeaf,
+  diffAreas,
+  loadTreeState,
+  saveTreeState,
+  signMerkleRoot,
+} from "./common.js";
+
+// Publishes a new version of a list signed before with generate_signed_json (or update_signed_json), updating only
+// the leaves of the areas that changed. The list file is rewritten with the areas in the order of the tree leaves.
+
+const usage =
+  "Usage: node update_signed_json <treeStateFile> <listFile> <validFrom> <validTo> <outputFile> <deltaFile>";
+
+if (!process.env.SIGNER_PK) throw new Error("$SIGNER_PK not defined");
+if (process.argv.length !== 8) throw new Error(usage);
+
+const signer = new ethers.Wallet(process.env.SIGNER_PK);
+const treeStateFile = process.argv[2];
+const listFile = process.argv[3];
+const validFrom = Number(process.argv[4]);
+const validTo = Number(process.argv[5]);
+const outputFile = process.argv[6];
+const deltaFile = process.argv[7];
+
+if (!Number.isInteger(validFrom) || !Number.isInteger(validTo))
+  throw new Error(`validFrom and validTo must be integers\n${usage}`);
+if (validFrom >= validTo) throw new Error("validFrom must be before validTo");
+for (const file of [treeStateFile, listFile]) {
+  if (!fs.existsSync(file)) throw new Error(`File not found: ${file}`);
+}
+
+const newList = JSON.parse(fs.readFileSync(listFile));
+const { tree, areas } = loadTreeState(treeStateFile);
+const baseRoot = tree.root;
+
+const changes = diffAreas(areas, newList.areas);
+console.log(`${changes.length} changed areas of ${areas.length}`);
+
+const delta = {
+  type: `${newList.type}_delta`,
+  baseRoot: baseRoot.toString(),
+  merkleRoot: null,
+  changes,
+};
+const newAreas = applyAreasDelta(areas, delta);
+
+const appended = [];
+for (const [position, h3Index, value] of changes) {
+  if (position < tree.size) {
+    tree.update(position, areaLeaf([h3Index, value]));
+  } else {
+    appended.push(areaLeaf([h3Index, value]));
+  }
+}
+if (appended.length > 0) tree.insertMany(appended);
+delta.merkleRoot = tree.root.toString();
+
+const output = await signMerkleRoot(signer, tree.root, validFrom, validTo);
+
+// Everything is written to temporary files first and then renamed into place, the signature last, so a failure
+// never leaves a signature for a list (or a tree state) that wasn't saved
+const tmp = (file) => `${file}.tmp`;
+fs.writeFileSync(tmp(deltaFile), JSON.stringify(delta, null, 2), "utf8");
+fs.writeFileSync(
+  tmp(listFile),
+  JSON.stringify({ ...newList, areas: newAreas }, null, 2),
+  "utf8",
+);
+saveTreeState(tmp(treeStateFile), tree, newAreas);
+fs.writeFileSync(tmp(outputFile), JSON.stringify(output, null, 2), "utf8");
+
+for (const file of [deltaFile, listFile, treeStateFile, outputFile]) {
+  fs.renameSync(tmp(file), file);
+}
+console.log(`Delta from ${delta.baseRoot} generated: ${deltaFile}`);
+console.log(`Signature succesfully generated: ${outputFile}`);